@@ -1,32 +1,40 @@
 import os
 from dataclasses import dataclass
+from typing import Literal, cast, get_args
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+_BOOL_TRUE = frozenset(("1", "true", "yes", "y", "on"))
+
+MediaPolicy = Literal["video_only", "all_media"]
+MEDIA_POLICIES: frozenset[str] = frozenset(get_args(MediaPolicy))
+
+
 def _as_bool(value: str | None, default: bool = False) -> bool:
     if value is None:
         return default
-    return value.strip().lower() in {"1", "true", "yes", "y", "on"}
+    return value.strip().lower() in _BOOL_TRUE
 
 
 def _as_int(value: str | None, default: int) -> int:
-    if value is None or not value.strip():
-        return default
-    return int(value)
+    s = (value or "").strip()
+    return int(s) if s else default
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Config:
     bot_token: str
     target_chat_id: int | None
 
     delete_channel_messages: bool
     ad_score_threshold: int
+    media_policy: MediaPolicy
 
     log_level: str
     test_mode_delete_admins: bool  # ← новое поле
+    admin_cache_ttl: int
 
 
 def load_config() -> Config:
@@ -34,11 +42,16 @@ def load_config() -> Config:
     if not token:
         raise RuntimeError("BOT_TOKEN is not set in .env")
 
-    chat_id_raw = os.getenv("TARGET_CHAT_ID")
-    chat_id = int(chat_id_raw) if chat_id_raw and chat_id_raw.strip() else None
+    chat_id_raw = (os.getenv("TARGET_CHAT_ID") or "").strip()
+    chat_id = int(chat_id_raw) if chat_id_raw else None
 
     delete_channel_messages = _as_bool(os.getenv("DELETE_CHANNEL_MESSAGES"), default=True)
     ad_score_threshold = _as_int(os.getenv("AD_SCORE_THRESHOLD"), default=2)
+
+    media_policy_raw = (os.getenv("MEDIA_POLICY") or "all_media").strip().lower()
+    if media_policy_raw not in MEDIA_POLICIES:
+        raise RuntimeError(f"MEDIA_POLICY must be one of {sorted(MEDIA_POLICIES)}")
+    media_policy = cast(MediaPolicy, media_policy_raw)
     log_level = (os.getenv("LOG_LEVEL") or "INFO").upper()
 
     # 🔥 Новая переменная
@@ -47,11 +60,16 @@ def load_config() -> Config:
         default=False,
     )
 
+    # Сколько секунд доверяем кэшу списка админов чата
+    admin_cache_ttl = _as_int(os.getenv("ADMIN_CACHE_TTL"), default=300)
+
     return Config(
         bot_token=token,
         target_chat_id=chat_id,
         delete_channel_messages=delete_channel_messages,
         ad_score_threshold=ad_score_threshold,
+        media_policy=media_policy,
         log_level=log_level,
         test_mode_delete_admins=test_mode_delete_admins,  # ← обязательно передаём
+        admin_cache_ttl=admin_cache_ttl,
     )
\ No newline at end of file
@@ -0,0 +1,23 @@
+from aiogram import F
+from aiogram.enums import ChatType
+from aiogram.types import Message
+
+
+# Фильтры регистрации хендлеров: aiogram отбрасывает неподходящие
+# апдейты ещё до вызова хендлера
+FORBIDDEN_MEDIA = {
+    "video_only": F.video,
+    "all_media": F.video | F.photo | F.document,
+}
+CHANNEL_SENDER = F.sender_chat.type == ChatType.CHANNEL
+HAS_TEXT = F.text | F.caption
+
+
+def forbidden_media(message: Message) -> str | None:
+    if message.video:
+        return "video"
+    if message.photo:
+        return "photo"
+    if message.document:
+        return "document"
+    return None
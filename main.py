@@ -1,53 +1,179 @@
 import asyncio
+import atexit
 import logging
-from datetime import datetime
+import os
+import time
 from pathlib import Path
 
+try:
+    import uvloop
+except ImportError:  # uvloop не поддерживает Windows
+    uvloop = None  # type: ignore[assignment]
+
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.dispatcher.event.bases import SkipHandler
 from aiogram.enums import ChatType
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
-from aiogram.types import Message
+from aiogram.filters import Command
+from aiogram.types import ChatMemberUpdated, Message
 
 from config import load_config
+from filters import CHANNEL_SENDER, FORBIDDEN_MEDIA, HAS_TEXT, forbidden_media
 from moderation import decide
 
 
 LOG_FILE = Path("moderation_log.txt")
+LOG_QUEUE_MAX_SIZE = 10_000
+LOG_FLUSH_BYTES = 64 * 1024
+LOG_FLUSH_INTERVAL = 0.2
+LOG_TEXT_LIMIT = 500
+
+_NEWLINES_TO_SPACES = str.maketrans("\r\n", "  ")
+_LOG_FMT = "[%s] chat_id=%s user_id=%s username=%s reason=%s %s text=%r\n"
+
+# Строки журнала модерации пишет в файл фоновая задача _log_writer
+_log_queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=LOG_QUEUE_MAX_SIZE)
+# Пустая строка в очереди — сигнал _log_writer завершиться
+_LOG_STOP = b""
+# Дескриптор файла журнала открывается один раз при старте, см. _open_log_file
+_log_fd: int | None = None
+
+# (unix-секунда, отформатированная метка времени)
+_ts_cache: tuple[int, str] = (0, "")
+
+_GROUP_TYPES: frozenset[str] = frozenset((ChatType.GROUP, ChatType.SUPERGROUP))
+_ADMIN_STATUSES: frozenset[str] = frozenset(("administrator", "creator"))
+
+POLLING_TIMEOUT = 30
+# chat_member нужен для обновления кэша администраторов
+ALLOWED_UPDATES = ["message", "chat_member"]
+
+# Сколько апдейтов обрабатывается одновременно (запросы к API идут параллельно)
+UPDATE_CONCURRENCY = 64
+
+HTTP_POOL_LIMIT = 100
+HTTP_KEEPALIVE_TIMEOUT = 75
+
+# Как часто не-админ по кэшу может форсировать /admincache в одном чате
+ADMIN_FORCED_REFRESH_COOLDOWN = 60
+
+# chat_id -> (id администраторов чата, expires_at по time.monotonic())
+_admin_ids: dict[int, tuple[frozenset[int], float]] = {}
+# chat_id -> запрос getChatAdministrators, который уже выполняется
+_admin_refresh: dict[int, asyncio.Task[frozenset[int]]] = {}
+# chat_id -> время последнего форсированного обновления по time.monotonic()
+_admin_forced_at: dict[int, float] = {}
+
+
+def _log_timestamp() -> str:
+    global _ts_cache
+    now = int(time.time())
+    if _ts_cache[0] != now:
+        _ts_cache = (now, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+    return _ts_cache[1]
 
 
 def write_moderation_log(message: Message, reason: str, extra: str = "") -> None:
     try:
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        text = (message.text or message.caption or "").replace("\n", " ").strip()
-        if len(text) > 500:
-            text = text[:500] + "..."
-
-        line = (
-            f"[{ts}] "
-            f"chat_id={message.chat.id} "
-            f"user_id={getattr(message.from_user, 'id', None)} "
-            f"username={getattr(message.from_user, 'username', None)} "
-            f"reason={reason} "
-            f"{extra} "
-            f"text={text!r}\n"
-        )
+        ts = _log_timestamp()
+
+        # Сначала обрезаем, чтобы не копировать длинный текст целиком
+        raw = message.text or message.caption or ""
+        text = raw[:LOG_TEXT_LIMIT]
+        if "\n" in text or "\r" in text:
+            text = text.translate(_NEWLINES_TO_SPACES)
+        text = text.strip()
+        if len(raw) > LOG_TEXT_LIMIT:
+            text += "..."
+
+        user = message.from_user
+        uid: int | None = None
+        username: str | None = None
+        if user is not None:
+            uid, username = user.id, user.username
+
+        line = _LOG_FMT % (ts, message.chat.id, uid, username, reason, extra, text)
+
+        # При переполнении очереди (QueueFull) строка отбрасывается
+        _log_queue.put_nowait(line.encode("utf-8"))
+    except Exception:
+        pass
+
+
+def _open_log_file() -> None:
+    global _log_fd
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+    _log_fd = os.open(LOG_FILE, flags, 0o644)
+    atexit.register(os.close, _log_fd)
+
 
-        with LOG_FILE.open("a", encoding="utf-8") as f:
-            f.write(line)
+def _write_log_lines(lines: list[bytes]) -> None:
+    if _log_fd is None:
+        return
+    try:
+        # Вся пачка уходит одним системным вызовом write
+        data = memoryview(b"".join(lines))
+        while data:
+            data = data[os.write(_log_fd, data):]
     except Exception:
         pass
 
 
-async def safe_delete(message: Message, log: logging.Logger, reason: str) -> bool:
+async def _log_writer() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await _log_queue.get()
+        if line == _LOG_STOP:
+            return
+        lines = [line]
+        size = len(line)
+        stop = False
+        deadline = loop.time() + LOG_FLUSH_INTERVAL
+        while size < LOG_FLUSH_BYTES:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(_log_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if line == _LOG_STOP:
+                stop = True
+                break
+            lines.append(line)
+            size += len(line)
+        # Запись на диск в пуле потоков, чтобы не блокировать event loop
+        await asyncio.to_thread(_write_log_lines, lines)
+        if stop:
+            return
+
+
+async def safe_delete(
+    message: Message,
+    log: logging.Logger,
+    reason: str,
+    detail: object = None,
+) -> bool:
     try:
         await message.delete()
-        log.info(
-            "DELETE SUCCESS | chat_id=%s | msg_id=%s | reason=%s",
-            message.chat.id,
-            message.message_id,
-            reason,
-        )
+        # reason и detail форматирует logging, только если INFO включён
+        if detail is None:
+            log.info(
+                "DELETE SUCCESS | chat_id=%s | msg_id=%s | reason=%s",
+                message.chat.id,
+                message.message_id,
+                reason,
+            )
+        else:
+            log.info(
+                "DELETE SUCCESS | chat_id=%s | msg_id=%s | reason=%s:%s",
+                message.chat.id,
+                message.message_id,
+                reason,
+                detail,
+            )
         return True
     except TelegramBadRequest as e:
         log.warning("DELETE BAD REQUEST | %s", e)
@@ -60,14 +186,56 @@ async def safe_delete(message: Message, log: logging.Logger, reason: str) -> boo
         return False
 
 
-def _detect_forbidden_media_kind(message: Message) -> str | None:
-    if message.video:
-        return "video"
-    if message.photo:
-        return "photo"
-    if message.document:
-        return "document"
-    return None
+async def _fetch_admins(bot: Bot, chat_id: int, ttl: float) -> frozenset[int]:
+    try:
+        members = await bot.get_chat_administrators(chat_id)
+        ids = frozenset(m.user.id for m in members)
+        _admin_ids[chat_id] = (ids, time.monotonic() + ttl)
+        return ids
+    finally:
+        del _admin_refresh[chat_id]
+
+
+async def _refresh_admins(bot: Bot, chat_id: int, ttl: float) -> frozenset[int]:
+    # Одновременные промахи по одному чату ждут один общий запрос к API
+    task = _admin_refresh.get(chat_id)
+    if task is None:
+        task = asyncio.create_task(_fetch_admins(bot, chat_id, ttl))
+        _admin_refresh[chat_id] = task
+    # shield: отмена одного ожидающего не отменяет запрос для остальных
+    return await asyncio.shield(task)
+
+
+def _update_admin(chat_id: int, user_id: int, is_admin: bool) -> None:
+    entry = _admin_ids.get(chat_id)
+    if entry is None:
+        return
+    ids, expires_at = entry
+    ids = ids | {user_id} if is_admin else ids - {user_id}
+    _admin_ids[chat_id] = (ids, expires_at)
+
+
+def _cached_admins(chat_id: int) -> frozenset[int] | None:
+    entry = _admin_ids.get(chat_id)
+    if entry is None or entry[1] <= time.monotonic():
+        return None
+    return entry[0]
+
+
+def _take_forced_refresh(chat_id: int) -> bool:
+    now = time.monotonic()
+    last = _admin_forced_at.get(chat_id)
+    if last is not None and now - last < ADMIN_FORCED_REFRESH_COOLDOWN:
+        return False
+    _admin_forced_at[chat_id] = now
+    return True
+
+
+async def _is_admin(bot: Bot, chat_id: int, user_id: int, ttl: float) -> bool:
+    ids = _cached_admins(chat_id)
+    if ids is None:
+        ids = await _refresh_admins(bot, chat_id, ttl)
+    return user_id in ids
 
 
 async def main() -> None:
@@ -85,86 +253,194 @@ async def main() -> None:
     log.info("CONFIG | target_chat_id=%s", cfg.target_chat_id)
     log.info("CONFIG | delete_channel_messages=%s", cfg.delete_channel_messages)
     log.info("CONFIG | ad_score_threshold=%s", cfg.ad_score_threshold)
-
-    bot = Bot(token=cfg.bot_token)
+    log.info("CONFIG | media_policy=%s", cfg.media_policy)
+    log.info("CONFIG | admin_cache_ttl=%s", cfg.admin_cache_ttl)
+
+    # Один пул keep-alive соединений к api.telegram.org на все запросы бота
+    session = AiohttpSession(limit=HTTP_POOL_LIMIT)
+    session._connector_init.update(
+        limit_per_host=HTTP_POOL_LIMIT,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    bot = Bot(token=cfg.bot_token, session=session)
     dp = Dispatcher()
 
-    @dp.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
-    async def handle_group_message(message: Message) -> None:
+    # Значения конфига, которые нужны хендлерам на каждое сообщение
+    target_chat_id = cfg.target_chat_id
+    test_mode_delete_admins = cfg.test_mode_delete_admins
+    ad_score_threshold = cfg.ad_score_threshold
+    admin_cache_ttl = cfg.admin_cache_ttl
+
+    @dp.chat_member()
+    async def handle_chat_member_update(event: ChatMemberUpdated) -> None:
+        member = event.new_chat_member
+        is_admin = member.status in _ADMIN_STATUSES
+        _update_admin(event.chat.id, member.user.id, is_admin)
         log.info(
-            "MESSAGE | chat=%s | user=%s | username=%s | text=%r",
-            message.chat.id,
-            getattr(message.from_user, "id", None),
-            getattr(message.from_user, "username", None),
-            message.text or message.caption,
+            "ADMIN CACHE | chat_id=%s | user_id=%s | status=%s",
+            event.chat.id,
+            member.user.id,
+            member.status,
         )
 
-        # Проверка чата
-        if cfg.target_chat_id is not None and message.chat.id != cfg.target_chat_id:
-            log.info("SKIP | wrong chat_id")
-            return
+    # Чужие чаты отсекаются фильтром ещё до вызова хендлеров
+    if target_chat_id is not None:
+        group_chat = F.chat.id == target_chat_id
+    else:
+        group_chat = F.chat.type.in_(_GROUP_TYPES)
+
+    @dp.message(Command("admincache"), group_chat)
+    async def handle_admincache(message: Message) -> None:
+        chat_id = message.chat.id
+        user = message.from_user
+        if user is None:
+            raise SkipHandler()
+
+        # Сначала права по кэшу. Не-админ по кэшу (например, новый админ,
+        # о повышении которого бот не узнал) может форсировать обновление
+        # не чаще раза в ADMIN_FORCED_REFRESH_COOLDOWN на чат
+        ids = _cached_admins(chat_id)
+        if ids is not None and user.id not in ids and not _take_forced_refresh(chat_id):
+            raise SkipHandler()
+
+        try:
+            ids = await _refresh_admins(bot, chat_id, admin_cache_ttl)
+        except Exception as e:
+            log.exception("ERROR refreshing admin cache | %r", e)
+            raise SkipHandler()
+
+        # Не-админов пропускаем дальше, к обычной модерации
+        if user.id not in ids:
+            raise SkipHandler()
+
+        log.info("ADMIN CACHE REFRESH | chat_id=%s | admins=%s", chat_id, len(ids))
+        try:
+            await message.reply("Список администраторов обновлён")
+        except Exception as e:
+            log.exception("ERROR replying to admincache | %r", e)
+
+    def log_message(message: Message) -> None:
+        if log.isEnabledFor(logging.INFO):
+            user = message.from_user
+            log.info(
+                "MESSAGE | chat=%s | user=%s | username=%s | text=%r",
+                message.chat.id,
+                user.id if user is not None else None,
+                user.username if user is not None else None,
+                message.text or message.caption,
+            )
+
+    async def is_exempt(message: Message) -> bool:
+        # В тестовом режиме удаляем и у админов, статус не запрашиваем
+        if test_mode_delete_admins:
+            return False
+
+        chat_id = message.chat.id
+
+        # Анонимный админ пишет от имени самой группы
+        sender_chat = message.sender_chat
+        if sender_chat is not None and sender_chat.id == chat_id:
+            log.info("SKIP | anonymous admin")
+            return True
 
         # Проверка статуса пользователя
-        if message.from_user:
+        user = message.from_user
+        if user is not None:
+            uid = user.id
             try:
-                member = await bot.get_chat_member(message.chat.id, message.from_user.id)
-                log.info(
-                    "USER STATUS | user_id=%s | status=%s | test_mode=%s",
-                    message.from_user.id,
-                    member.status,
-                    cfg.test_mode_delete_admins,
-                )
-
-                if (
-                    not cfg.test_mode_delete_admins
-                    and member.status in ("administrator", "creator")
-                ):
+                is_admin = await _is_admin(bot, chat_id, uid, admin_cache_ttl)
+                log.info("USER STATUS | user_id=%s | is_admin=%s", uid, is_admin)
+
+                if is_admin:
                     log.info("SKIP | admin and test_mode disabled")
-                    return
+                    return True
 
             except Exception as e:
                 log.exception("ERROR getting member status | %r", e)
 
-        # Медиа
-        forbidden_kind = _detect_forbidden_media_kind(message)
-        if forbidden_kind:
-            log.info("TRIGGER | forbidden media | type=%s", forbidden_kind)
-            write_moderation_log(message, "media_forbidden", f"type={forbidden_kind}")
-            await safe_delete(message, log, f"media_forbidden:{forbidden_kind}")
+        return False
+
+    async def should_moderate(message: Message) -> bool:
+        log_message(message)
+        return not await is_exempt(message)
+
+    # Медиа
+    @dp.message(group_chat, FORBIDDEN_MEDIA[cfg.media_policy])
+    async def handle_forbidden_media(message: Message) -> None:
+        if not await should_moderate(message):
             return
 
-        # Channel sender
-        if cfg.delete_channel_messages and message.sender_chat is not None:
-            if message.sender_chat.type == ChatType.CHANNEL:
-                log.info("TRIGGER | channel sender message")
-                write_moderation_log(message, "channel_sender")
-                await safe_delete(message, log, "channel_sender")
+        forbidden_kind = forbidden_media(message)
+        log.info("TRIGGER | forbidden media | type=%s", forbidden_kind)
+        write_moderation_log(message, "media_forbidden", f"type={forbidden_kind}")
+        await safe_delete(message, log, "media_forbidden", forbidden_kind)
+
+    # Channel sender
+    if cfg.delete_channel_messages:
+
+        @dp.message(group_chat, CHANNEL_SENDER)
+        async def handle_channel_sender(message: Message) -> None:
+            if not await should_moderate(message):
                 return
 
-        # Антиреклама
-        d = decide(message, threshold=cfg.ad_score_threshold)
+            log.info("TRIGGER | channel sender message")
+            write_moderation_log(message, "channel_sender")
+            await safe_delete(message, log, "channel_sender")
+
+    # Антиреклама: только сообщения с текстом или подписью
+    @dp.message(group_chat, HAS_TEXT)
+    async def handle_text_message(message: Message) -> None:
+        log_message(message)
+
+        d = decide(message, threshold=ad_score_threshold)
+        score, should_delete, reasons = d.score, d.should_delete, d.reasons
 
         log.info(
             "DECIDE | score=%s | should_delete=%s | reasons=%s",
-            d.score,
-            d.should_delete,
-            d.reasons,
+            score,
+            should_delete,
+            reasons,
         )
 
-        if d.should_delete:
+        # Статус автора запрашиваем, только если сообщение пойдёт под удаление
+        if should_delete:
+            if await is_exempt(message):
+                return
+
             log.info("TRIGGER | ad detected")
             write_moderation_log(
                 message,
                 "ad_detected",
-                f"score={d.score} reasons={','.join(d.reasons)}",
+                f"score={score} reasons={','.join(reasons)}",
             )
-            await safe_delete(message, log, f"ad_score:{d.score}")
+            await safe_delete(message, log, "ad_score", score)
             return
 
         log.info("MESSAGE PASSED")
 
-    await dp.start_polling(bot)
+    try:
+        _open_log_file()
+    except OSError as e:
+        log.error("MODERATION LOG DISABLED | %r", e)
+
+    log_writer = asyncio.create_task(_log_writer())
+    try:
+        await dp.start_polling(
+            bot,
+            polling_timeout=POLLING_TIMEOUT,
+            handle_as_tasks=True,
+            tasks_concurrency_limit=UPDATE_CONCURRENCY,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    finally:
+        # Останавливаем писателя через очередь, а не cancel(): так он
+        # гарантированно допишет всё, что было поставлено до остановки
+        await _log_queue.put(_LOG_STOP)
+        await log_writer
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -2,19 +2,26 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
-from typing import Iterable
+from functools import lru_cache
+from typing import Any, Callable, Iterable
 
 from aiogram.types import Message, MessageEntity
 
+try:
+    import ahocorasick  # type: ignore[import-not-found]
+except ImportError:
+    ahocorasick = None
 
+
+# Применяется к уже приведённому к нижнему регистру тексту, поэтому без (?i)
 URL_RE = re.compile(
-    r"(?i)\b("
+    r"\b("
     r"https?://[^\s]+|"
     r"www\.[^\s]+|"
     r"t(?:\.|[ ]|[\[\(]?\.\]?|[․·∙•])?me/[^\s]+|"
     r"telegram\.me/[^\s]+|"
     r"(?:joinchat)/[^\s]+|"
-    r"@[A-Za-z0-9_]{4,}"
+    r"@[a-z0-9_]{4,}"
     r")\b"
 )
 
@@ -43,60 +50,128 @@ SERVICE_TRIGGERS = [
 ]
 
 
+LINK_ENTITY_TYPES = frozenset(("url", "text_link", "mention"))
+
 EMOJI_RE = re.compile(r"[\U0001F300-\U0001FAFF]")
 
 
-@dataclass
+def _cp1251_bytes_without(keep: Callable[[str], bool]) -> bytes:
+    chars = bytes(range(256)).decode("cp1251", "replace")
+    return bytes(i for i, c in enumerate(chars) if not keep(c))
+
+
+# Байты cp1251, которые удаляются перед подсчётом букв / заглавных букв
+_CP1251_NON_LETTERS = _cp1251_bytes_without(str.isalpha)
+_CP1251_NON_UPPER = _cp1251_bytes_without(lambda c: c.isalpha() and c.isupper())
+
+PHRASE_GROUPS: dict[str, list[str]] = {
+    "contact": CONTACT_PHRASES,
+    "strong": TRIGGERS_STRONG,
+    "money": TRIGGERS_MONEY,
+    "service": SERVICE_TRIGGERS,
+}
+
+
+def _build_phrase_automaton() -> Any:
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for group, phrases in PHRASE_GROUPS.items():
+        for phrase in phrases:
+            automaton.add_word(phrase, (group, phrase))
+    automaton.make_automaton()
+    return automaton
+
+
+# Один проход по тексту вместо поиска каждой фразы по отдельности
+_PHRASE_AUTOMATON = _build_phrase_automaton()
+
+
+# Решения кэшируются и переиспользуются, поэтому неизменяемые
+@dataclass(frozen=True)
 class ModerationDecision:
     should_delete: bool
     score: int
-    reasons: list[str]
+    reasons: tuple[str, ...]
 
 
-def _extract_text_and_entities(message: Message) -> tuple[str, list[MessageEntity]]:
+def _extract_text_and_entities(message: Message) -> tuple[str, Iterable[MessageEntity]]:
     if message.text:
-        return message.text, list(message.entities or [])
+        return message.text, message.entities or ()
     if message.caption:
-        return message.caption, list(message.caption_entities or [])
-    return "", []
+        return message.caption, message.caption_entities or ()
+    return "", ()
+
 
+def _has_link_entity(entities: Iterable[MessageEntity]) -> bool:
+    return any(e.type in LINK_ENTITY_TYPES for e in entities)
 
-def _has_link_or_contact(text: str, entities: Iterable[MessageEntity]) -> bool:
-    if URL_RE.search(text):
+
+def _may_contain_url(text: str) -> bool:
+    # Любая ветка URL_RE содержит "/", "@" или "www."
+    return "/" in text or "@" in text or "www." in text
+
+
+def _has_link_or_contact(text: str, has_link_entity: bool, contact_hits: int) -> bool:
+    if has_link_entity or contact_hits > 0:
         return True
-    for e in entities:
-        if e.type in ("url", "text_link", "mention"):
-            return True
-    for p in CONTACT_PHRASES:
-        if p in text:
-            return True
-    return False
+    return _may_contain_url(text) and URL_RE.search(text) is not None
 
 
 def _count_hits(text: str, phrases: list[str]) -> int:
     return sum(1 for p in phrases if p in text)
 
 
+def _count_phrase_hits(text: str) -> dict[str, int]:
+    # Считаем различные фразы группы, как и _count_hits, а не число вхождений
+    if _PHRASE_AUTOMATON is None:
+        return {group: _count_hits(text, phrases) for group, phrases in PHRASE_GROUPS.items()}
+
+    counts: dict[str, int] = dict.fromkeys(PHRASE_GROUPS, 0)
+    for group, _ in {value for _, value in _PHRASE_AUTOMATON.iter(text)}:
+        counts[group] += 1
+    return counts
+
+
+def _count_letters(text: str, emoji_count: int) -> tuple[int, int]:
+    # Быстрый путь: латиница и кириллица укладываются в cp1251, и буквы
+    # считаются через bytes.translate в C. Если при кодировании пропало
+    # что-то кроме эмодзи (уже посчитанных), считаем посимвольно.
+    encoded = text.encode("cp1251", "ignore")
+    if len(text) - len(encoded) == emoji_count:
+        letters = len(encoded.translate(None, _CP1251_NON_LETTERS))
+        upper = len(encoded.translate(None, _CP1251_NON_UPPER))
+        return letters, upper
+
+    alpha = [c for c in text if c.isalpha()]
+    return len(alpha), sum(1 for c in alpha if c.isupper())
+
+
 def _lots_of_emoji_or_caps(text: str) -> bool:
     emoji_count = len(EMOJI_RE.findall(text))
-    letters = [c for c in text if c.isalpha()]
+    letters, upper_letters = _count_letters(text, emoji_count)
     if not letters:
         return False
-    upper_letters = [c for c in letters if c.isupper()]
-    return emoji_count >= 4 or (len(upper_letters) / len(letters) >= 0.6)
+    return emoji_count >= 4 or (upper_letters / letters >= 0.6)
 
 
 def decide(message: Message, threshold: int = 2) -> ModerationDecision:
     text, entities = _extract_text_and_entities(message)
+    return _decide_text(text, _has_link_entity(entities), threshold)
+
+
+# Спам-волны рассылают один и тот же текст с разных аккаунтов
+@lru_cache(maxsize=4096)
+def _decide_text(text: str, has_link_entity: bool, threshold: int) -> ModerationDecision:
     text_l = text.lower()
 
-    score = 0
+    score: int = 0
     reasons: list[str] = []
 
-    has_contact = _has_link_or_contact(text_l, entities)
+    hits = _count_phrase_hits(text_l)
 
-    strong_hits = _count_hits(text_l, TRIGGERS_STRONG)
-    money_hits = _count_hits(text_l, TRIGGERS_MONEY)
+    strong_hits = hits["strong"]
+    money_hits = hits["money"]
 
     if strong_hits:
         score += 2
@@ -106,14 +181,16 @@ def decide(message: Message, threshold: int = 2) -> ModerationDecision:
         score += 1
         reasons.append(f"money_ads:{money_hits}")
 
-    service_hits = _count_hits(text_l, SERVICE_TRIGGERS)
-    if service_hits and has_contact:
+    # Ссылки ищем, только если есть предложение услуг: больше они ни на что не влияют
+    service_hits = hits["service"]
+    if service_hits and _has_link_or_contact(text_l, has_link_entity, hits["contact"]):
         score += 2
         reasons.append(f"service_offer:{service_hits}")
 
-    if _lots_of_emoji_or_caps(text):
+    # Эмодзи/капс дают +1: если порог не достигается и с ними, не считаем их
+    if score + 1 >= threshold and _lots_of_emoji_or_caps(text):
         score += 1
         reasons.append("emoji_or_caps")
 
     should_delete = score >= threshold
-    return ModerationDecision(should_delete=should_delete, score=score, reasons=reasons)
+    return ModerationDecision(should_delete=should_delete, score=score, reasons=tuple(reasons))